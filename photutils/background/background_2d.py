@@ -4,15 +4,18 @@ This module defines classes to estimate the 2D background and background
 RMS in an image.
 """
 
-from itertools import product
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import inspect
+import warnings
 
 from astropy.stats import SigmaClip
 from astropy.utils import lazyproperty
+from astropy.utils.exceptions import AstropyUserWarning
 import numpy as np
-from numpy.lib.index_tricks import index_exp
 
-from .core import SExtractorBackground, StdBackgroundRMS
-from ..utils import ShepardIDWInterpolator
+from .core import (BackgroundBase, BackgroundRMSBase, SExtractorBackground,
+                   StdBackgroundRMS, _nanmedian)
 
 SIGMA_CLIP = SigmaClip(sigma=3.0, maxiters=10)
 
@@ -25,7 +28,7 @@ class BkgZoomInterpolator:
     """
     This class generates full-sized background and background RMS images
     from lower-resolution mesh images using the `~scipy.ndimage.zoom`
-    (spline) interpolator.
+    (spline) interpolator or Fourier interpolation.
 
     This class must be used in concert with the `Background2D` class.
 
@@ -35,21 +38,116 @@ class BkgZoomInterpolator:
         The order of the spline interpolation used to resize the
         low-resolution background and background RMS mesh images.  The
         value must be an integer in the range 0-5.  The default is 3
-        (bicubic interpolation).
+        (bicubic interpolation).  Used only if ``method='spline'``.
 
     mode : {'reflect', 'constant', 'nearest', 'wrap'}, optional
         Points outside the boundaries of the input are filled according
-        to the given mode.  Default is 'reflect'.
+        to the given mode.  Default is 'reflect'.  Used only if
+        ``method='spline'``.
 
     cval : float, optional
         The value used for points outside the boundaries of the input if
         ``mode='constant'``. Default is 0.0
+
+    method : {'spline', 'fft'}, optional
+        The interpolation method:
+
+        * ``'spline'``: spline interpolation using
+          `~scipy.ndimage.zoom` (default).
+        * ``'fft'``: Fourier interpolation, where the mesh is
+          transformed with a discrete cosine transform, zero-padded to
+          the output size, and inverse transformed.  The cosine
+          transform implies a mirror-symmetric extension of the mesh,
+          which avoids the wrap-around artifacts of a periodic FFT.
+          This method is typically faster for large zoom factors, but
+          it may produce ringing near sharp features in the mesh.
     """
 
-    def __init__(self, order=3, mode='reflect', cval=0.0):
+    def __init__(self, order=3, mode='reflect', cval=0.0, method='spline'):
+        if method not in ('spline', 'fft'):
+            raise ValueError('method must be "spline" or "fft"')
+
         self.order = order
         self.mode = mode
         self.cval = cval
+        self.method = method
+
+    @staticmethod
+    def _fft_zoom(mesh, shape):
+        """
+        Resize a 2D mesh array to the given shape using Fourier
+        (discrete cosine transform) interpolation.
+
+        The mesh pixels are assumed to be centered on the output pixel
+        grid, i.e., each mesh pixel covers an equal-sized block of the
+        output array.
+
+        Parameters
+        ----------
+        mesh : 2D `~numpy.ndarray`
+            The low-resolution 2D mesh array.
+
+        shape : 2 tuple of int
+            The output shape.
+
+        Returns
+        -------
+        result : 2D `~numpy.ndarray`
+            The resized array.
+        """
+
+        from scipy.fft import dctn, idctn
+
+        coeffs = dctn(mesh, type=2, norm='ortho', workers=-1)
+        result = idctn(coeffs, type=2, s=shape, norm='ortho', workers=-1)
+        result *= np.sqrt((shape[0] * shape[1]) / mesh.size)
+
+        return result
+
+    @staticmethod
+    def _linear_zoom(mesh, shape):
+        """
+        Resize a 2D mesh array to the given shape using separable
+        linear interpolation.
+
+        This gives the same result as `~scipy.ndimage.zoom` with
+        ``order=1``, but each axis is interpolated in a single
+        vectorized pass.
+
+        Parameters
+        ----------
+        mesh : 2D `~numpy.ndarray`
+            The low-resolution 2D mesh array.
+
+        shape : 2 tuple of int
+            The output shape.
+
+        Returns
+        -------
+        result : 2D `~numpy.ndarray`
+            The resized array.
+        """
+
+        result = mesh.astype(float)
+        for axis, size in enumerate(shape):
+            nmesh = result.shape[axis]
+            if nmesh == 1:
+                result = np.repeat(result, size, axis=axis)
+                continue
+
+            # the input coordinates of the output pixels, where the
+            # corner pixels of the input and output arrays are aligned
+            coords = np.linspace(0, nmesh - 1, size)
+            idx0 = np.minimum(coords.astype(int), nmesh - 2)
+            frac = coords - idx0
+            if axis == 0:
+                frac = frac[:, np.newaxis]
+
+            result0 = np.take(result, idx0, axis=axis)
+            result1 = np.take(result, idx0 + 1, axis=axis)
+            result = result0 + frac * (result1 - result0)
+
+        return result
 
     def __call__(self, mesh, bkg2d_obj):
         """
@@ -70,31 +168,37 @@ class BkgZoomInterpolator:
         """
 
         mesh = np.asanyarray(mesh)
-        if np.ptp(mesh) == 0:
-            return np.zeros_like(bkg2d_obj.data) + np.min(mesh)
-
-        from scipy.ndimage import zoom
+        mesh_min = mesh.min()
+        if mesh_min == mesh.max():
+            # keep the floating-point dtype of the data (e.g., float32)
+            data_dtype = bkg2d_obj.data.dtype
+            dtype = (data_dtype if np.issubdtype(data_dtype, np.floating)
+                     else np.float64)
+            return np.full(bkg2d_obj.data.shape, mesh_min, dtype=dtype)
 
         if bkg2d_obj.edge_method == 'pad':
             # The mesh is first resized to the larger padded-data size
             # (i.e., zoom_factor should be an integer) and then cropped
             # back to the final data size.
-            zoom_factor = (int(bkg2d_obj.nyboxes * bkg2d_obj.box_size[0] /
-                               mesh.shape[0]),
-                           int(bkg2d_obj.nxboxes * bkg2d_obj.box_size[1] /
-                               mesh.shape[1]))
-            result = zoom(mesh, zoom_factor, order=self.order, mode=self.mode,
-                          cval=self.cval)
-
-            return result[0:bkg2d_obj.data.shape[0],
-                          0:bkg2d_obj.data.shape[1]]
+            shape = (bkg2d_obj.nyboxes * bkg2d_obj.box_size[0],
+                     bkg2d_obj.nxboxes * bkg2d_obj.box_size[1])
         else:
             # The mesh is resized directly to the final data size.
-            zoom_factor = (float(bkg2d_obj.data.shape[0] / mesh.shape[0]),
-                           float(bkg2d_obj.data.shape[1] / mesh.shape[1]))
+            shape = bkg2d_obj.data.shape
+
+        if self.method == 'fft':
+            result = self._fft_zoom(mesh, shape)
+        elif self.order == 1:
+            result = self._linear_zoom(mesh, shape)
+        else:
+            from scipy.ndimage import zoom
+
+            zoom_factor = (shape[0] / mesh.shape[0],
+                           shape[1] / mesh.shape[1])
+            result = zoom(mesh, zoom_factor, order=self.order, mode=self.mode,
+                          cval=self.cval)
 
-            return zoom(mesh, zoom_factor, order=self.order, mode=self.mode,
-                        cval=self.cval)
+        return result[0:bkg2d_obj.data.shape[0], 0:bkg2d_obj.data.shape[1]]
 
 
 class BkgIDWInterpolator:
@@ -150,15 +254,22 @@ class BkgIDWInterpolator:
         """
 
         mesh = np.asanyarray(mesh)
-        if np.ptp(mesh) == 0:
-            return np.zeros_like(bkg2d_obj.data) + np.min(mesh)
+        mesh_min = mesh.min()
+        if mesh_min == mesh.max():
+            # keep the floating-point dtype of the data (e.g., float32)
+            data_dtype = bkg2d_obj.data.dtype
+            dtype = (data_dtype if np.issubdtype(data_dtype, np.floating)
+                     else np.float64)
+            return np.full(bkg2d_obj.data.shape, mesh_min, dtype=dtype)
 
         mesh1d = mesh[bkg2d_obj.mesh_yidx, bkg2d_obj.mesh_xidx]
-        interp_func = ShepardIDWInterpolator(bkg2d_obj.yx, mesh1d,
-                                             leafsize=self.leafsize)
-        data = interp_func(bkg2d_obj.data_coords,
-                           n_neighbors=self.n_neighbors, power=self.power,
-                           reg=self.reg)
+
+        # the full-sized neighbor indices and weights are not cached
+        # because they are much larger than the data itself
+        idx, weights = _calc_idw_weights(
+            bkg2d_obj.yx, bkg2d_obj.data_coords, leafsize=self.leafsize,
+            n_neighbors=self.n_neighbors, power=self.power, reg=self.reg)
+        data = np.einsum('ij,ij->i', weights, mesh1d[idx])
 
         return data.reshape(bkg2d_obj.data.shape)
 
@@ -177,9 +288,10 @@ class Background2D:
 
     Parameters
     ----------
-    data : array_like
+    data : array_like or `~numpy.ma.MaskedArray`
         The 2D array from which to estimate the background and/or
-        background RMS map.
+        background RMS map.  If ``data`` is a `~numpy.ma.MaskedArray`,
+        its mask is combined with the input ``mask``.
 
     box_size : int or array_like (int)
         The box size along each axis.  If ``box_size`` is a scalar then
@@ -194,7 +306,8 @@ class Background2D:
         A boolean mask, with the same shape as ``data``, where a `True`
         value indicates the corresponding element of ``data`` is
         masked. Masked data are excluded from calculations. ``mask`` is
-        intended to mask sources or bad pixels. Use ``coverage_mask``
+        intended to mask sources or bad pixels. NaN values in ``data``
+        are always treated as masked. Use ``coverage_mask``
         to mask blank areas of an image. ``mask`` and ``coverage_mask``
         differ only in that ``coverage_mask`` is applied to the output
         background and background RMS maps (see ``fill_value``).
@@ -268,10 +381,13 @@ class Background2D:
         `~numpy.ma.MaskedArray` and have an ``axis`` keyword
         (internally, the background will be calculated along
         ``axis=1``).  The callable object must return a 1D
-        `~numpy.ma.MaskedArray`.  If ``bkg_estimator`` includes sigma
-        clipping, it will be ignored (use the ``sigma_clip`` keyword to
-        define sigma clipping).  The default is an instance of
-        `~photutils.background.SExtractorBackground`.
+        `~numpy.ndarray` or `~numpy.ma.MaskedArray`.  Photutils
+        background classes are called with ``masked=False`` (i.e.,
+        masked pixels are represented by ``np.nan``); any other callable
+        is passed a `~numpy.ma.MaskedArray`.  If ``bkg_estimator``
+        includes sigma clipping, it will be ignored (use the
+        ``sigma_clip`` keyword to define sigma clipping).  The default
+        is an instance of `~photutils.background.SExtractorBackground`.
 
     bkgrms_estimator : callable, optional
         A callable object (a function or e.g., an instance of any
@@ -281,10 +397,13 @@ class Background2D:
         `~numpy.ma.MaskedArray` and have an ``axis`` keyword
         (internally, the background RMS will be calculated along
         ``axis=1``).  The callable object must return a 1D
-        `~numpy.ma.MaskedArray`.  If ``bkgrms_estimator`` includes sigma
-        clipping, it will be ignored (use the ``sigma_clip`` keyword to
-        define sigma clipping).  The default is an instance of
-        `~photutils.background.StdBackgroundRMS`.
+        `~numpy.ndarray` or `~numpy.ma.MaskedArray`.  Photutils
+        background RMS classes are called with ``masked=False`` (i.e.,
+        masked pixels are represented by ``np.nan``); any other callable
+        is passed a `~numpy.ma.MaskedArray`.  If ``bkgrms_estimator``
+        includes sigma clipping, it will be ignored (use the
+        ``sigma_clip`` keyword to define sigma clipping).  The default
+        is an instance of `~photutils.background.StdBackgroundRMS`.
 
     interpolator : callable, optional
         A callable object (a function or object) used to interpolate the
@@ -292,6 +411,16 @@ class Background2D:
         full-size background or background RMS maps.  The default is an
         instance of `BkgZoomInterpolator`.
 
+    nthreads : int, optional
+        The number of threads used to sigma clip the meshes and to
+        calculate the background and background RMS of each mesh.  The
+        meshes are split into ``nthreads`` groups that are processed
+        concurrently.  This is useful only if the sigma clipping and
+        estimator functions release the GIL (as most of the underlying
+        numpy functions do) and any custom ``bkg_estimator`` and
+        ``bkgrms_estimator`` must be thread safe.  The default is 1 (no
+        threading).
+
     Notes
     -----
     If there is only one background mesh element (i.e., ``box_size`` is
@@ -299,13 +428,17 @@ class Background2D:
     be a constant image.
     """
 
+    # NaN-ignoring median used for the mesh filtering (uses bottleneck
+    # if it is installed)
+    _nanmedian = staticmethod(_nanmedian)
+
     def __init__(self, data, box_size, *, mask=None, coverage_mask=None,
                  fill_value=0.0, exclude_percentile=10.0, filter_size=(3, 3),
                  filter_threshold=None, edge_method='pad',
                  sigma_clip=SIGMA_CLIP,
                  bkg_estimator=SExtractorBackground(sigma_clip=None),
                  bkgrms_estimator=StdBackgroundRMS(sigma_clip=None),
-                 interpolator=BkgZoomInterpolator()):
+                 interpolator=BkgZoomInterpolator(), nthreads=1):
 
         data = np.asanyarray(data)
 
@@ -317,11 +450,18 @@ class Background2D:
         self.box_npixels = self.box_size[0] * self.box_size[1]
 
         if mask is not None:
-            mask = np.asanyarray(mask)
+            mask = np.asanyarray(mask, dtype=bool)
             if mask.shape != data.shape:
                 raise ValueError('mask and data must have the same shape')
+        if np.ma.isMaskedArray(data):
+            # the mask of a masked array input is combined with the
+            # input mask
+            data_mask = np.ma.getmaskarray(data)
+            if data_mask.any():
+                mask = data_mask if mask is None else mask | data_mask
+            data = np.ma.getdata(data)
         if coverage_mask is not None:
-            coverage_mask = np.asanyarray(coverage_mask)
+            coverage_mask = np.asanyarray(coverage_mask, dtype=bool)
             if coverage_mask.shape != data.shape:
                 raise ValueError('coverage_mask and data must have the same '
                                  'shape')
@@ -330,6 +470,9 @@ class Background2D:
             raise ValueError('exclude_percentile must be between 0 and 100 '
                              '(inclusive).')
 
+        if nthreads < 1:
+            raise ValueError('nthreads must be a positive integer')
+
         self.data = data
         self._mask = mask
         self.coverage_mask = coverage_mask
@@ -350,13 +493,14 @@ class Background2D:
         self.bkg_estimator = bkg_estimator
         self.bkgrms_estimator = bkgrms_estimator
         self.interpolator = interpolator
+        self.nthreads = int(nthreads)
 
         self.background_mesh = None
         self.background_rms_mesh = None
+        self._idw_cache = {}
 
         self._prepare_data()
         self._calc_bkg_bkgrms()
-        self._calc_coordinates()
 
     def _combine_masks(self):
         if self._mask is None and self.coverage_mask is None:
@@ -368,78 +512,49 @@ class Background2D:
         else:
             return np.logical_or(self._mask, self.coverage_mask)
 
-    def _pad_data(self, yextra, xextra):
+    @staticmethod
+    def _mesh_slices(npixels, nboxes, box_size):
         """
-        Pad the ``data`` and ``mask`` to have an integer number of
-        background meshes of size ``box_size`` in both dimensions.  The
-        padding is added on the top and/or right edges (this is the best
-        option for the "zoom" interpolator).
+        Define the slices that map the data pixels along one axis onto
+        the meshes.
+
+        If ``nboxes * box_size`` is larger than ``npixels`` (i.e., the
+        data are padded), the last mesh is only partially filled.  If
+        it is smaller (i.e., the data are cropped), the extra data
+        pixels are not used.
 
         Parameters
         ----------
-        yextra, xextra : int
-            The modulus of the data size and the box size in both the
-            ``y`` and ``x`` dimensions.  This is the number of extra
-            pixels beyond a multiple of the box size in the ``y`` and
-            ``x`` dimensions.
+        npixels : int
+            The number of data pixels along the axis.
 
-        Returns
-        -------
-        result : `~numpy.ma.MaskedArray`
-            The padded data and mask as a masked array.
-        """
+        nboxes : int
+            The number of meshes along the axis.
 
-        ypad = 0
-        xpad = 0
-        if yextra > 0:
-            ypad = self.box_size[0] - yextra
-        if xextra > 0:
-            xpad = self.box_size[1] - xextra
-        pad_width = ((0, ypad), (0, xpad))
-        data = np.pad(self.data, pad_width, mode='constant',
-                      constant_values=[1.e10])
-
-        # mask the padded regions
-        pad_mask = np.zeros(data.shape, dtype=bool)
-        yidx = data.shape[0] - ypad
-        xidx = data.shape[1] - xpad
-        pad_mask[yidx:, :] = True
-        pad_mask[:, xidx:] = True
-
-        # pad the input mask separately (there is no np.ma.pad function)
-        if self.mask is not None:
-            mask = np.pad(self.mask, pad_width, mode='constant',
-                          constant_values=[True])
-            mask = np.logical_or(mask, pad_mask)
-        else:
-            mask = pad_mask
-
-        return np.ma.masked_array(data, mask=mask)
-
-    def _crop_data(self):
-        """
-        Crop the ``data`` and ``mask`` to have an integer number of
-        background meshes of size ``box_size`` in both dimensions.  The
-        data are cropped on the top and/or right edges (this is the best
-        option for the "zoom" interpolator).
+        box_size : int
+            The mesh size along the axis.
 
         Returns
         -------
-        result : `~numpy.ma.MaskedArray`
-            The cropped data and mask as a masked array.
+        slices : list of 3 tuple of slice
+            A list of ``(data_slice, box_slice, pixel_slice)`` tuples,
+            where ``data_slice`` selects the data pixels,
+            ``box_slice`` selects the meshes, and ``pixel_slice``
+            selects the pixels within those meshes.
         """
 
-        ny_crop = self.nyboxes * self.box_size[1]
-        nx_crop = self.nxboxes * self.box_size[0]
-        crop_slc = index_exp[0:ny_crop, 0:nx_crop]
-        if self.mask is not None:
-            mask = self.mask[crop_slc]
-        else:
-            mask = False
+        nfull = min(npixels // box_size, nboxes)
+        slices = [(slice(0, nfull * box_size), slice(0, nfull),
+                   slice(None))]
+        if nfull < nboxes:
+            # the last (padded) mesh
+            slices.append((slice(nfull * box_size, npixels),
+                           slice(nfull, nboxes),
+                           slice(0, npixels - nfull * box_size)))
 
-        return np.ma.masked_array(self.data[crop_slc], mask=mask)
+        return slices
 
-    def _select_meshes(self, data):
+    def _select_meshes(self, nmasked):
         """
         Define the x and y indices with respect to the low-resolution
         mesh image of the meshes to use for the background
@@ -450,9 +565,9 @@ class Background2D:
 
         Parameters
         ----------
-        data : 2D `~numpy.ma.MaskedArray`
-            A 2D array where the y dimension represents each mesh and
-            the x dimension represents the data in each mesh.
+        nmasked : 1D `~numpy.ndarray`
+            The number of masked pixels in each mesh (see
+            `_count_masked`).
 
         Returns
         -------
@@ -460,9 +575,6 @@ class Background2D:
             The 1D mesh indices.
         """
 
-        # the number of masked pixels in each mesh
-        nmasked = np.ma.count_masked(data, axis=1)
-
         # meshes that contain more than ``exclude_percentile`` percent
         # masked pixels are excluded:
         #   - for exclude_percentile=0, good meshes will be only where
@@ -482,18 +594,37 @@ class Background2D:
 
         return mesh_idx
 
+    @staticmethod
+    def _count_masked(data):
+        """
+        Count the number of masked pixels in each mesh.
+
+        Parameters
+        ----------
+        data : 2D `~numpy.ndarray`
+            A 2D array where the y dimension represents each mesh and
+            the x dimension represents the data in each mesh.  Masked
+            pixels are represented by ``np.nan``.
+
+        Returns
+        -------
+        nmasked : 1D `~numpy.ndarray`
+            The number of masked pixels in each mesh.
+        """
+
+        return np.count_nonzero(np.isnan(data), axis=1)
+
     def _prepare_data(self):
         """
         Prepare the data.
 
-        First, pad or crop the 2D data array so that there are an
-        integer number of meshes in both dimensions, creating a masked
-        array.
-
-        Then reshape into a different 2D masked array where each row
-        represents the data in a single mesh.  This method also performs
-        a first cut at rejecting certain meshes as specified by the
-        input keywords.
+        The 2D data array is padded or cropped so that there are an
+        integer number of meshes in both dimensions and reshaped into a
+        2D float `~numpy.ndarray` where each row represents the data in
+        a single mesh.  Masked and padded pixels are represented by
+        ``np.nan``.  This method also performs a first
+        cut at rejecting certain meshes as specified by the input
+        keywords.
         """
 
         self.nyboxes = self.data.shape[0] // self.box_size[0]
@@ -501,33 +632,62 @@ class Background2D:
         yextra = self.data.shape[0] % self.box_size[0]
         xextra = self.data.shape[1] % self.box_size[1]
 
-        if (xextra + yextra) == 0:
-            # no resizing of the data is necessary
-            data_ma = np.ma.masked_array(self.data, mask=self.mask)
-        else:
-            # pad or crop the data
+        if (xextra + yextra) > 0:
             if self.edge_method == 'pad':
-                data_ma = self._pad_data(yextra, xextra)
-                self.nyboxes = data_ma.shape[0] // self.box_size[0]
-                self.nxboxes = data_ma.shape[1] // self.box_size[1]
+                # the padding is added on the top and/or right edges
+                # (this is the best option for the "zoom" interpolator)
+                self.nyboxes += int(yextra > 0)
+                self.nxboxes += int(xextra > 0)
             elif self.edge_method == 'crop':
-                data_ma = self._crop_data()
+                # the data are cropped on the top and/or right edges
+                yextra = xextra = 0
             else:
                 raise ValueError('edge_method must be "pad" or "crop"')
 
         self.nboxes = self.nxboxes * self.nyboxes
 
-        # a reshaped 2D masked array with mesh data along the x axis
-        mesh_data = np.ma.swapaxes(
-                        data_ma.reshape(
-                            self.nyboxes, self.box_size[0],
-                            self.nxboxes, self.box_size[1]),
-                        1, 2).reshape(self.nyboxes * self.nxboxes,
-                                      self.box_npixels)
+        # a reshaped 2D array with mesh data along the x axis; the data
+        # are copied exactly once (without an intermediate padded or
+        # cropped image) into a C-contiguous float array so that the
+        # pixels of each mesh are contiguous in memory
+        mesh_data = np.empty((self.nboxes, self.box_npixels))
+
+        # a (nyboxes, box_ny, nxboxes, box_nx) view of the mesh data
+        mesh4d = np.swapaxes(mesh_data.reshape(self.nyboxes, self.nxboxes,
+                                               *self.box_size), 1, 2)
+
+        # padded pixels are represented by NaN
+        if yextra > 0:
+            mesh4d[-1, yextra:] = np.nan
+        if xextra > 0:
+            mesh4d[:, :, -1, xextra:] = np.nan
+
+        yslices = self._mesh_slices(self.data.shape[0], self.nyboxes,
+                                    self.box_size[0])
+        xslices = self._mesh_slices(self.data.shape[1], self.nxboxes,
+                                    self.box_size[1])
+        for ydata, ybox, ypix in yslices:
+            for xdata, xbox, xpix in xslices:
+                mesh_block = mesh4d[ybox, ypix, xbox, xpix]
+                mesh_block[...] = self.data[ydata, xdata].reshape(
+                    mesh_block.shape)
+
+                # masked pixels are replaced by NaN to avoid the
+                # overhead of masked arrays in the sigma clipping and
+                # statistics
+                if self.mask is not None:
+                    mask = self.mask[ydata, xdata].reshape(mesh_block.shape)
+                    mesh_block[mask] = np.nan
 
         # first cut on rejecting meshes
-        self.mesh_idx = self._select_meshes(mesh_data)
-        self._mesh_data = mesh_data[self.mesh_idx, :]
+        nmasked = self._count_masked(mesh_data)
+        self.mesh_idx = self._select_meshes(nmasked)
+        if len(self.mesh_idx) == self.nboxes:
+            self._mesh_data = mesh_data
+            self._nmasked1d = nmasked
+        else:
+            self._mesh_data = mesh_data[self.mesh_idx, :]
+            self._nmasked1d = nmasked[self.mesh_idx]
 
     def _make_2d_array(self, data):
         """
@@ -552,18 +712,29 @@ class Background2D:
         if np.ma.is_masked(data):
             raise ValueError('data must not be a masked array')
 
-        data2d = np.zeros(self._mesh_shape).astype(data.dtype)
+        data2d = np.zeros(self._mesh_shape, dtype=data.dtype)
         data2d[self.mesh_yidx, self.mesh_xidx] = data
 
         if len(self.mesh_idx) == self.nboxes:
             # no meshes were masked
             return data2d
         else:
-            # some meshes were masked
-            mask2d = np.ones(data2d.shape).astype(bool)
-            mask2d[self.mesh_yidx, self.mesh_xidx] = False
+            # some meshes were masked; the cached mask is copied so that
+            # the returned arrays do not share their masks
+            return np.ma.masked_array(data2d, mask=self._mesh_mask.copy())
 
-            return np.ma.masked_array(data2d, mask=mask2d)
+    @lazyproperty
+    def _mesh_mask(self):
+        """
+        A 2D boolean mask of the low-resolution mesh array, where `True`
+        indicates meshes that were excluded from the background
+        estimation.
+        """
+
+        mask = np.ones(self._mesh_shape, dtype=bool)
+        mask[self.mesh_yidx, self.mesh_xidx] = False
+
+        return mask
 
     def _interpolate_meshes(self, data, n_neighbors=10, eps=0.0, power=1.0,
                             reg=0.0):
@@ -574,10 +745,13 @@ class Background2D:
         This is required to use a regular-grid interpolator to expand
         the low-resolution image to the full size image.
 
+        Only the masked pixels are interpolated; the unmasked pixels
+        are unchanged.
+
         Parameters
         ----------
-        data : 1D `~numpy.ndarray`
-            A 1D array of mesh values.
+        data : 2D `~numpy.ma.MaskedArray`
+            A 2D masked array of mesh values (see `_make_2d_array`).
 
         n_neighbors : int, optional
             The maximum number of nearest neighbors to use during the
@@ -605,14 +779,42 @@ class Background2D:
             filled by IDW interpolation.
        """
 
-        yx = np.column_stack([self.mesh_yidx, self.mesh_xidx])
-        coords = np.array(list(product(range(self.nyboxes),
-                                       range(self.nxboxes))))
-        interp_func = ShepardIDWInterpolator(yx, data)
-        img1d = interp_func(coords, n_neighbors=n_neighbors, power=power,
-                            eps=eps, reg=reg)
+        idx, weights = self._get_idw_weights(n_neighbors=n_neighbors,
+                                             eps=eps, power=power, reg=reg)
+        data1d = np.ma.getdata(data)[self.mesh_yidx, self.mesh_xidx]
+        img2d = np.ma.getdata(data).copy()
+        img2d[self._mesh_mask] = np.einsum('ij,ij->i', weights, data1d[idx])
 
-        return img1d.reshape(self._mesh_shape)
+        return img2d
+
+    def _get_idw_weights(self, **kwargs):
+        """
+        Get the (cached) IDW neighbor indices and weights of the
+        excluded low-resolution mesh pixels.
+
+        The weights depend only on the mesh positions, so they are
+        computed once and reused for both the background and background
+        RMS meshes.
+
+        Parameters
+        ----------
+        kwargs : `dict`
+            Any keyword arguments accepted by `_calc_idw_weights`.
+
+        Returns
+        -------
+        idx, weights : 2D `~numpy.ndarray`
+            The neighbor indices and normalized weights (see
+            `_calc_idw_weights`).
+        """
+
+        key = tuple(sorted(kwargs.items()))
+        if key not in self._idw_cache:
+            yx = np.column_stack([self.mesh_yidx, self.mesh_xidx])
+            coords = np.argwhere(self._mesh_mask)
+            self._idw_cache[key] = _calc_idw_weights(yx, coords, **kwargs)
+
+        return self._idw_cache[key]
 
     def _selective_filter(self, data, indices):
         """
@@ -637,34 +839,79 @@ class Background2D:
             The filtered 2D array of mesh values.
         """
 
+        # only the windows of the filtered pixels are copied
         data_out = np.copy(data)
-        for i, j in zip(*indices):
-            yfs, xfs = self.filter_size
-            hyfs, hxfs = yfs // 2, xfs // 2
-            yidx0 = max(i - hyfs, 0)
-            yidx1 = min(i - hyfs + yfs, data.shape[0])
-            xidx0 = max(j - hxfs, 0)
-            xidx1 = min(j - hxfs + xfs, data.shape[1])
-            data_out[i, j] = np.median(data[yidx0:yidx1, xidx0:xidx1])
+        windows = self._filter_windows(data)[indices]
+        data_out[indices] = self._window_median(windows)
 
         return data_out
 
+    def _filter_windows(self, data):
+        """
+        Extract the ``filter_size`` window centered on each pixel of the
+        2D mesh array.
+
+        The windows are defined in the same way as for
+        `scipy.ndimage.median_filter` with ``origin=0``.  Window pixels
+        outside of the array borders are set to ``np.nan``.
+
+        Parameters
+        ----------
+        data : 2D `~numpy.ndarray`
+            A 2D array of mesh values.
+
+        Returns
+        -------
+        windows : 4D `~numpy.ndarray`
+            A read-only strided view of shape ``(ny, nx, filter_ny,
+            filter_nx)`` containing the window values for each mesh
+            pixel.
+        """
+
+        yfs, xfs = self.filter_size
+        hyfs, hxfs = yfs // 2, xfs // 2
+        pad_width = ((hyfs, yfs - hyfs - 1), (hxfs, xfs - hxfs - 1))
+        padded = np.pad(data.astype(float), pad_width, mode='constant',
+                        constant_values=np.nan)
+
+        return np.lib.stride_tricks.as_strided(
+            padded, shape=data.shape + (yfs, xfs),
+            strides=padded.strides * 2, writeable=False)
+
+    def _window_median(self, windows):
+        """
+        Calculate the NaN-ignoring median over the last two (window)
+        axes of an array of filter windows.
+
+        Parameters
+        ----------
+        windows : `~numpy.ndarray`
+            An array of filter windows, where the window pixels are
+            along the last two axes.
+
+        Returns
+        -------
+        result : `~numpy.ndarray`
+            The median of each window.
+        """
+
+        # bottleneck does not accept a tuple of axes
+        windows = windows.reshape(windows.shape[:-2]
+                                  + (np.prod(windows.shape[-2:]),))
+        return self._nanmedian(windows, axis=-1)
+
     def _filter_meshes(self):
         """
         Apply a 2D median filter to the low-resolution 2D mesh,
         including only pixels inside the image at the borders.
         """
 
-        from scipy.ndimage import generic_filter
-
         if self.filter_threshold is None:
             # filter the entire arrays
-            self.background_mesh = generic_filter(
-                self.background_mesh, np.nanmedian, size=self.filter_size,
-                mode='constant', cval=np.nan)
-            self.background_rms_mesh = generic_filter(
-                self.background_rms_mesh, np.nanmedian,
-                size=self.filter_size, mode='constant', cval=np.nan)
+            self.background_mesh = self._window_median(
+                self._filter_windows(self.background_mesh))
+            self.background_rms_mesh = self._window_median(
+                self._filter_windows(self.background_rms_mesh))
         else:
             # selectively filter
             indices = np.nonzero(self.background_mesh > self.filter_threshold)
@@ -673,6 +920,94 @@ class Background2D:
             self.background_rms_mesh = self._selective_filter(
                 self.background_rms_mesh, indices)
 
+    def _apply_rowwise(self, func, data):
+        """
+        Apply a function to groups of rows (meshes) of a 2D array.
+
+        The row groups are processed concurrently if ``nthreads`` is
+        larger than 1.
+
+        Parameters
+        ----------
+        func : callable
+            The function to apply.  It must take a 2D array and return
+            an array whose first dimension matches the number of input
+            rows.
+
+        data : 2D `~numpy.ndarray`
+            The input 2D array.
+
+        Returns
+        -------
+        result : `~numpy.ndarray`
+            The concatenated output of ``func``.
+        """
+
+        nthreads = min(self.nthreads, data.shape[0])
+        if nthreads <= 1:
+            return func(data)
+
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            results = list(executor.map(func,
+                                        np.array_split(data, nthreads)))
+
+        return np.concatenate(results)
+
+    def _sigma_clip_meshes(self, data):
+        """
+        Sigma clip each row (mesh) of the NaN-masked 2D mesh data
+        in-place.
+        """
+
+        def sigma_clip(data):
+            # SigmaClip may store state during clipping, so each row
+            # group uses its own copy
+            return copy.copy(self.sigma_clip)(data, axis=1, masked=False,
+                                              copy=False)
+
+        # the input data contain NaN values for masked pixels
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', category=AstropyUserWarning,
+                                    message='Input data contains invalid '
+                                    'values')
+            return self._apply_rowwise(sigma_clip, data)
+
+    def _apply_estimator(self, estimator, data):
+        """
+        Apply a background or background RMS estimator along the mesh
+        axis of the NaN-masked 2D mesh data.
+
+        Photutils estimators whose ``calc_background`` or
+        ``calc_background_rms`` method accepts the ``masked`` keyword
+        operate directly on the NaN-masked array.  Any other callable
+        is passed a `~numpy.ma.MaskedArray`.
+
+        Parameters
+        ----------
+        estimator : callable
+            The background or background RMS estimator.
+
+        data : 2D `~numpy.ndarray`
+            A 2D array where the y dimension represents each mesh and
+            the x dimension represents the data in each mesh.  Masked
+            pixels are represented by ``np.nan``.
+
+        Returns
+        -------
+        result : 1D `~numpy.ndarray`
+            The estimated value for each mesh.
+        """
+
+        if _accepts_masked(estimator):
+            def func(data):
+                return estimator(data, axis=1, masked=False)
+        else:
+            def func(data):
+                return np.ma.getdata(estimator(np.ma.masked_invalid(data),
+                                               axis=1))
+
+        return self._apply_rowwise(func, data)
+
     def _calc_bkg_bkgrms(self):
         """
         Calculate the background and background RMS estimate in each of
@@ -687,35 +1022,44 @@ class Background2D:
         """
 
         if self.sigma_clip is not None:
-            data_sigclip = self.sigma_clip(self._mesh_data, axis=1)
+            data_sigclip = self._sigma_clip_meshes(self._mesh_data)
+            nmasked = self._count_masked(data_sigclip)
         else:
+            # the masked pixels are unchanged without sigma clipping
             data_sigclip = self._mesh_data
+            nmasked = self._nmasked1d
         del self._mesh_data
 
         # preform mesh rejection on sigma-clipped data (i.e., for any
         # newly-masked pixels)
-        idx = self._select_meshes(data_sigclip)
-        self.mesh_idx = self.mesh_idx[idx]  # indices for the output mesh
-        self._data_sigclip = data_sigclip[idx]  # always a 2D masked array
+        idx = self._select_meshes(nmasked)
+        if len(idx) != len(self.mesh_idx):
+            self.mesh_idx = self.mesh_idx[idx]  # indices for the output mesh
+            data_sigclip = data_sigclip[idx]  # NaN represents masked
+            nmasked = nmasked[idx]
+        self._nmasked1d = nmasked
 
         self._mesh_shape = (self.nyboxes, self.nxboxes)
         self.mesh_yidx, self.mesh_xidx = np.unravel_index(self.mesh_idx,
                                                           self._mesh_shape)
 
         # These properties are needed later to calculate
-        # background_mesh_ma and background_rms_mesh_ma.  Note that _bkg1d
-        # and _bkgrms1d are masked arrays, but the mask should always be
-        # False.
-        self._bkg1d = self.bkg_estimator(self._data_sigclip, axis=1)
-        self._bkgrms1d = self.bkgrms_estimator(self._data_sigclip, axis=1)
-
-        # make the unfiltered 2D mesh arrays (these are not masked)
-        if len(self._bkg1d) == self.nboxes:
-            bkg = self._make_2d_array(self._bkg1d)
-            bkgrms = self._make_2d_array(self._bkgrms1d)
-        else:
-            bkg = self._interpolate_meshes(self._bkg1d)
-            bkgrms = self._interpolate_meshes(self._bkgrms1d)
+        # background_mesh_ma and background_rms_mesh_ma.
+        self._bkg1d = self._apply_estimator(self.bkg_estimator,
+                                            data_sigclip)
+        self._bkgrms1d = self._apply_estimator(self.bkgrms_estimator,
+                                               data_sigclip)
+
+        # make the unfiltered 2D mesh arrays (these are not masked);
+        # the masked arrays of the excluded meshes are kept for
+        # background_mesh_ma and background_rms_mesh_ma
+        bkg = self._make_2d_array(self._bkg1d)
+        bkgrms = self._make_2d_array(self._bkgrms1d)
+        if len(self._bkg1d) != self.nboxes:
+            self._bkg_mesh_ma = bkg
+            self._bkgrms_mesh_ma = bkgrms
+            bkg = self._interpolate_meshes(bkg)
+            bkgrms = self._interpolate_meshes(bkgrms)
 
         self._background_mesh_unfiltered = bkg
         self._background_rms_mesh_unfiltered = bkgrms
@@ -726,27 +1070,47 @@ class Background2D:
         if not np.array_equal(self.filter_size, [1, 1]):
             self._filter_meshes()
 
-    def _calc_coordinates(self):
+    @lazyproperty
+    def y(self):
+        """
+        The ``y`` pixel coordinates of the centers of the included
+        meshes, used to initialize an interpolator.
+        """
+
+        return (self.mesh_yidx * self.box_size[0]
+                + (self.box_size[0] - 1) / 2.)
+
+    @lazyproperty
+    def x(self):
+        """
+        The ``x`` pixel coordinates of the centers of the included
+        meshes, used to initialize an interpolator.
         """
-        Calculate the coordinates to use when calling an interpolator.
 
-        These are needed for `Background2D` and `BackgroundIDW2D`.
+        return (self.mesh_xidx * self.box_size[1]
+                + (self.box_size[1] - 1) / 2.)
 
-        Regular-grid interpolators require a 2D array of values.  Some
-        require a 2D meshgrid of x and y.  Other require a strictly
-        increasing 1D array of the x and y ranges.
+    @lazyproperty
+    def yx(self):
         """
+        The ``(y, x)`` pixel coordinates of the centers of the included
+        meshes used to initialize an IDW interpolator.
 
-        # the position coordinates used to initialize an interpolation
-        self.y = (self.mesh_yidx * self.box_size[0] +
-                  (self.box_size[0] - 1) / 2.)
-        self.x = (self.mesh_xidx * self.box_size[1] +
-                  (self.box_size[1] - 1) / 2.)
-        self.yx = np.column_stack([self.y, self.x])
+        This is a 2D array of shape ``(nmeshes, 2)``.
+        """
 
-        # the position coordinates used when calling an interpolator
-        nx, ny = self.data.shape
-        self.data_coords = np.array(list(product(range(ny), range(nx))))
+        return np.column_stack([self.y, self.x])
+
+    @lazyproperty
+    def data_coords(self):
+        """
+        The ``(y, x)`` pixel coordinates of the full-sized ``data`` array
+        used when calling an IDW interpolator.
+
+        This is a 2D array of shape ``(ny * nx, 2)``.
+        """
+
+        return np.indices(self.data.shape).reshape(2, -1).T
 
     @lazyproperty
     def mesh_nmasked(self):
@@ -756,8 +1120,7 @@ class Background2D:
         The array is masked only if meshes were excluded.
         """
 
-        return self._make_2d_array(
-            np.ma.count_masked(self._data_sigclip, axis=1))
+        return self._make_2d_array(self._nmasked1d)
 
     @lazyproperty
     def background_mesh_ma(self):
@@ -770,7 +1133,7 @@ class Background2D:
         if len(self._bkg1d) == self.nboxes:
             return self.background_mesh
         else:
-            return self._make_2d_array(self._bkg1d)  # masked array
+            return self._bkg_mesh_ma
 
     @lazyproperty
     def background_rms_mesh_ma(self):
@@ -783,7 +1146,7 @@ class Background2D:
         if len(self._bkgrms1d) == self.nboxes:
             return self.background_rms_mesh
         else:
-            return self._make_2d_array(self._bkgrms1d)  # masked array
+            return self._bkgrms_mesh_ma
 
     @lazyproperty
     def background_median(self):
@@ -823,8 +1186,44 @@ class Background2D:
             bkg_rms[self.coverage_mask] = self.fill_value
         return bkg_rms
 
+    def _mesh_box_edges(self):
+        """
+        Calculate the pixel coordinates of the edges of the included
+        mesh boxes.
+
+        Returns
+        -------
+        xlo, xhi, ylo, yhi : 1D `~numpy.ndarray`
+            The lower and upper ``x`` and ``y`` edges of each box.
+        """
+
+        hbx = self.box_size[1] / 2.
+        hby = self.box_size[0] / 2.
+
+        return self.x - hbx, self.x + hbx, self.y - hby, self.y + hby
+
+    @lazyproperty
+    def _box_corners(self):
+        """
+        The (read-only) vertices of the closed outlines of the included
+        mesh boxes, used by `plot_meshes`.
+
+        This is a 3D array of shape ``(nmeshes, 5, 2)``, where the last
+        axis contains the ``(x, y)`` coordinates.
+        """
+
+        xlo, xhi, ylo, yhi = self._mesh_box_edges()
+        corners = np.empty((len(xlo), 5, 2))
+        corners[:, [0, 3, 4], 0] = xlo[:, np.newaxis]
+        corners[:, [1, 2], 0] = xhi[:, np.newaxis]
+        corners[:, [0, 1, 4], 1] = ylo[:, np.newaxis]
+        corners[:, [2, 3], 1] = yhi[:, np.newaxis]
+        corners.flags.writeable = False
+
+        return corners
+
     def plot_meshes(self, axes=None, marker='+', color='blue', outlines=False,
-                    **kwargs):
+                    rasterized=False, **kwargs):
         """
         Plot the low-resolution mesh boxes on a matplotlib Axes
         instance.
@@ -833,35 +1232,192 @@ class Background2D:
         ----------
         axes : `matplotlib.axes.Axes` or `None`, optional
             The matplotlib axes on which to plot.  If `None`, then the
-            current `~matplotlib.axes.Axes` instance is used.
+            current `~matplotlib.axes.Axes` instance is used.  If the
+            axes limits have been fixed (i.e., autoscaling is off), then
+            only the boxes that overlap the axes limits are plotted.
 
         marker : str, optional
             The marker to use to mark the center of the boxes.  Default
             is '+'.
 
-        color : str, optional
-            The color for the markers and the box outlines.  Default is
+        color : str or list of str, optional
+            The color for the markers and the box outlines.  A sequence
+            of colors (one per mesh box) may also be input.  Default is
             'blue'.
 
         outlines : bool, optional
             Whether or not to plot the box outlines in addition to the
             box centers.
 
+        rasterized : bool, optional
+            Whether to rasterize the box centers and outlines when the
+            figure is saved in a vector format (e.g., PDF or SVG).
+            Rasterizing greatly reduces the file size and drawing time
+            for a large number of boxes.
+
         kwargs : `dict`
             Any keyword arguments accepted by
-            `matplotlib.patches.Patch`.  Used only if ``outlines`` is
-            True.
+            `matplotlib.collections.LineCollection`.  Used only if
+            ``outlines`` is True.
         """
 
-        import matplotlib.pyplot as plt
+        from matplotlib.colors import is_color_like
 
-        kwargs['color'] = color
         if axes is None:
+            import matplotlib.pyplot as plt
             axes = plt.gca()
-        axes.scatter(self.x, self.y, marker=marker, color=color)
+
+        # boxes outside of fixed (i.e., not autoscaled) axes limits
+        # are not drawn
+        x, y = self.x, self.y
+        verts = self._box_corners
+        single_color = is_color_like(color)
+        fixed_x = not axes.get_autoscalex_on()
+        fixed_y = not axes.get_autoscaley_on()
+        if fixed_x or fixed_y:
+            # the lower-left and upper-right box corners
+            (xlo, ylo), (xhi, yhi) = verts[:, 0].T, verts[:, 2].T
+            visible = np.ones(x.shape, dtype=bool)
+            if fixed_x:
+                xmin, xmax = sorted(axes.get_xlim())
+                visible &= (xhi >= xmin) & (xlo <= xmax)
+            if fixed_y:
+                ymin, ymax = sorted(axes.get_ylim())
+                visible &= (yhi >= ymin) & (ylo <= ymax)
+
+            if not visible.all():
+                x, y, verts = x[visible], y[visible], verts[visible]
+                if not single_color:
+                    color = np.asarray(color)[visible]
+
+        if single_color:
+            # a single Line2D is much faster than scatter for markers of
+            # a single color
+            axes.plot(x, y, marker=marker, color=color, linestyle='none',
+                      rasterized=rasterized)
+        else:
+            axes.scatter(x, y, marker=marker, color=color,
+                         rasterized=rasterized)
         if outlines:
-            from ..aperture import RectangularAperture
-            xy = np.column_stack([self.x, self.y])
-            apers = RectangularAperture(xy, self.box_size[1],
-                                        self.box_size[0], 0.)
-            apers.plot(axes=axes, **kwargs)
+            from matplotlib.collections import LineCollection
+
+            # all of the box outlines are drawn as a single collection
+            axes.add_collection(LineCollection(verts, colors=color,
+                                               rasterized=rasterized,
+                                               **kwargs))
+
+            # unlike plot, add_collection does not update the
+            # (autoscaled) axes limits
+            if not (fixed_x and fixed_y):
+                axes.autoscale_view()
+
+
+def _accepts_masked(estimator):
+    """
+    Determine whether a background or background RMS estimator
+    supports the ``masked`` keyword.
+
+    User-defined subclasses of `BackgroundBase` and `BackgroundRMSBase`
+    may implement ``calc_background`` or ``calc_background_rms``
+    without the ``masked`` keyword.
+
+    Parameters
+    ----------
+    estimator : callable
+        The background or background RMS estimator.
+
+    Returns
+    -------
+    result : bool
+        `True` if the estimator can be called with ``masked=False``.
+    """
+
+    if isinstance(estimator, BackgroundBase):
+        method = estimator.calc_background
+    elif isinstance(estimator, BackgroundRMSBase):
+        method = estimator.calc_background_rms
+    else:
+        return False
+
+    params = inspect.signature(method).parameters.values()
+    return any(param.name == 'masked'
+               or param.kind == inspect.Parameter.VAR_KEYWORD
+               for param in params)
+
+
+def _calc_idw_weights(coordinates, positions, leafsize=10, n_neighbors=10,
+                      eps=0.0, power=1.0, reg=0.0, conf_dist=1e-12):
+    """
+    Calculate the inverse distance weights used to interpolate values
+    at the known ``coordinates`` to ``positions``.
+
+    The weights are the same as those used by
+    `~photutils.utils.ShepardIDWInterpolator`, but they are computed
+    for all positions at once and can be reused for different values.
+    The interpolated values are given by ``np.sum(weights *
+    values[idx], axis=1)``.
+
+    Parameters
+    ----------
+    coordinates : Nx2 `~numpy.ndarray`
+        The coordinates of the known data points.
+
+    positions : Mx2 `~numpy.ndarray`
+        The coordinates at which to interpolate.
+
+    leafsize : float, optional
+        The number of points at which the k-d tree algorithm switches
+        over to brute-force.
+
+    n_neighbors : int, optional
+        The maximum number of nearest neighbors to use during the
+        interpolation.
+
+    eps : float, optional
+        Set to use approximate nearest neighbors.  See
+        `scipy.spatial.cKDTree.query` for further information.
+
+    power : float, optional
+        The power of the inverse distance used for the interpolation
+        weights.
+
+    reg : float, optional
+        The regularization parameter.
+
+    conf_dist : float, optional
+        The confusion distance below which the value of the closest
+        data point is used instead of interpolating.
+
+    Returns
+    -------
+    idx : MxK `~numpy.ndarray`
+        The indices of the ``K`` nearest neighbors of each position.
+
+    weights : MxK `~numpy.ndarray`
+        The normalized weights of the ``K`` nearest neighbors of each
+        position.
+    """
+
+    from scipy.spatial import cKDTree
+
+    kdtree = cKDTree(coordinates, leafsize=leafsize)
+    distances, idx = kdtree.query(positions, k=n_neighbors, eps=eps)
+    if n_neighbors == 1:
+        return idx[:, np.newaxis], np.ones((idx.shape[0], 1))
+
+    # missing neighbors (if n_neighbors > the number of data points)
+    # have infinite distances and are given zero weight
+    valid = np.isfinite(distances)
+    idx[~valid] = 0
+    with np.errstate(divide='ignore'):
+        weights = np.where(valid, 1.0 / ((distances ** power) + reg), 0.0)
+
+    # use the closest data point for positions close to a data point
+    confused = distances[:, 0] <= conf_dist
+    weights[confused] = 0.0
+    weights[confused, 0] = 1.0
+
+    with np.errstate(invalid='ignore'):
+        weights /= np.sum(weights, axis=1, keepdims=True)
+
+    return idx, weights
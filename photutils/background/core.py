@@ -5,11 +5,18 @@ RMS in an array of any dimension.
 """
 
 import abc
+import warnings
 
 from astropy.stats import (biweight_location, biweight_scale, mad_std,
                            SigmaClip)
 import numpy as np
 
+try:
+    import bottleneck
+    HAS_BOTTLENECK = True
+except ImportError:
+    HAS_BOTTLENECK = False
+
 SIGMA_CLIP = SigmaClip(sigma=3.0, maxiters=10)
 
 __all__ = ['BackgroundBase', 'BackgroundRMSBase', 'MeanBackground',
@@ -52,6 +59,50 @@ def _masked_median(data, axis=None):
     return _median
 
 
+def _nanmedian(data, axis=None):
+    """
+    Calculate the median of an array, ignoring NaN values.
+
+    `bottleneck.nanmedian` is used if bottleneck is installed.
+    Otherwise, the median along a single axis is calculated from one
+    vectorized sort of the data.  This is much faster than
+    `numpy.nanmedian`, which loops over the array in Python for large
+    arrays.  Slices containing only NaN values return NaN (without a
+    warning).
+
+    Parameters
+    ----------
+    data : array-like
+        The input data.
+    axis : int or `None`, optional
+        The array axis along which the median is calculated.  If
+        `None`, then the entire array is used.
+
+    Returns
+    -------
+    result : float or `~numpy.ndarray`
+        The resulting median.
+    """
+
+    if HAS_BOTTLENECK and not isinstance(axis, tuple):
+        return bottleneck.nanmedian(data, axis=axis)
+
+    data = np.asarray(data)
+    if axis is None or isinstance(axis, tuple) or data.size == 0:
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', 'All-NaN slice encountered',
+                                    RuntimeWarning)
+            return np.nanmedian(data, axis=axis)
+
+    data = np.sort(data, axis=axis)  # NaN values are sorted to the end
+    nvalid = np.expand_dims(np.count_nonzero(~np.isnan(data), axis=axis),
+                            axis)
+    lower = np.take_along_axis(data, np.maximum((nvalid - 1) // 2, 0), axis)
+    upper = np.take_along_axis(data, nvalid // 2, axis)
+
+    return np.squeeze((lower + upper) / 2., axis=axis)[()]
+
+
 class BackgroundBase(metaclass=abc.ABCMeta):
     """
     Base class for classes that estimate scalar background values.
@@ -68,11 +119,15 @@ class BackgroundBase(metaclass=abc.ABCMeta):
     def __init__(self, sigma_clip=SIGMA_CLIP):
         self.sigma_clip = sigma_clip
 
-    def __call__(self, data, axis=None):
-        return self.calc_background(data, axis=axis)
+    def __call__(self, data, axis=None, masked=True):
+        # masked is passed only if needed to support subclasses
+        # written without the masked keyword
+        if masked:
+            return self.calc_background(data, axis=axis)
+        return self.calc_background(data, axis=axis, masked=False)
 
     @abc.abstractmethod
-    def calc_background(self, data, axis=None):
+    def calc_background(self, data, axis=None, masked=True):
         """
         Calculate the background value.
 
@@ -83,13 +138,22 @@ class BackgroundBase(metaclass=abc.ABCMeta):
         axis : int or `None`, optional
             The array axis along which the background is calculated.  If
             `None`, then the entire array is used.
+        masked : bool, optional
+            If `True` (default), then ``data`` may be a
+            `~numpy.ma.MaskedArray` and a `~numpy.ma.MaskedArray` is
+            returned when ``axis`` is not `None`.  If `False`, then
+            ``data`` must be a `~numpy.ndarray` where masked values are
+            represented by ``np.nan`` and a `~numpy.ndarray` is returned
+            (with ``np.nan`` where all values along ``axis`` are
+            masked).  The latter avoids the overhead of masked arrays.
 
         Returns
         -------
-        result : float or `~numpy.ma.MaskedArray`
+        result : float, `~numpy.ndarray`, or `~numpy.ma.MaskedArray`
             The calculated background value.  If ``axis`` is `None` then
             a scalar will be returned, otherwise a
-            `~numpy.ma.MaskedArray` will be returned.
+            `~numpy.ma.MaskedArray` (``masked=True``) or
+            `~numpy.ndarray` (``masked=False``) will be returned.
         """
 
         raise NotImplementedError('Needs to be implemented in a subclass.')
@@ -111,11 +175,15 @@ class BackgroundRMSBase(metaclass=abc.ABCMeta):
     def __init__(self, sigma_clip=SIGMA_CLIP):
         self.sigma_clip = sigma_clip
 
-    def __call__(self, data, axis=None):
-        return self.calc_background_rms(data, axis=axis)
+    def __call__(self, data, axis=None, masked=True):
+        # masked is passed only if needed to support subclasses
+        # written without the masked keyword
+        if masked:
+            return self.calc_background_rms(data, axis=axis)
+        return self.calc_background_rms(data, axis=axis, masked=False)
 
     @abc.abstractmethod
-    def calc_background_rms(self, data, axis=None):
+    def calc_background_rms(self, data, axis=None, masked=True):
         """
         Calculate the background RMS value.
 
@@ -126,13 +194,22 @@ class BackgroundRMSBase(metaclass=abc.ABCMeta):
         axis : int or `None`, optional
             The array axis along which the background RMS is calculated.
             If `None`, then the entire array is used.
+        masked : bool, optional
+            If `True` (default), then ``data`` may be a
+            `~numpy.ma.MaskedArray` and a `~numpy.ma.MaskedArray` is
+            returned when ``axis`` is not `None`.  If `False`, then
+            ``data`` must be a `~numpy.ndarray` where masked values are
+            represented by ``np.nan`` and a `~numpy.ndarray` is returned
+            (with ``np.nan`` where all values along ``axis`` are
+            masked).  The latter avoids the overhead of masked arrays.
 
         Returns
         -------
-        result : float or `~numpy.ma.MaskedArray`
+        result : float, `~numpy.ndarray`, or `~numpy.ma.MaskedArray`
             The calculated background RMS value.  If ``axis`` is `None`
             then a scalar will be returned, otherwise a
-            `~numpy.ma.MaskedArray` will be returned.
+            `~numpy.ma.MaskedArray` (``masked=True``) or
+            `~numpy.ndarray` (``masked=False``) will be returned.
         """
 
         raise NotImplementedError('Needs to be implemented in a subclass.')
@@ -174,11 +251,14 @@ class MeanBackground(BackgroundBase):
     49.5
     """
 
-    def calc_background(self, data, axis=None):
+    def calc_background(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
+            data = self.sigma_clip(data, axis=axis, masked=masked)
 
-        return np.ma.mean(data, axis=axis)
+        if masked:
+            return np.ma.mean(data, axis=axis)
+        else:
+            return np.nanmean(data, axis=axis)
 
 
 class MedianBackground(BackgroundBase):
@@ -217,11 +297,14 @@ class MedianBackground(BackgroundBase):
     49.5
     """
 
-    def calc_background(self, data, axis=None):
+    def calc_background(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
+            data = self.sigma_clip(data, axis=axis, masked=masked)
 
-        return _masked_median(data, axis=axis)
+        if masked:
+            return _masked_median(data, axis=axis)
+        else:
+            return _nanmedian(data, axis=axis)
 
 
 class ModeEstimatorBackground(BackgroundBase):
@@ -270,11 +353,18 @@ class ModeEstimatorBackground(BackgroundBase):
         self.median_factor = median_factor
         self.mean_factor = mean_factor
 
-    def calc_background(self, data, axis=None):
+    def calc_background(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
-        return ((self.median_factor * _masked_median(data, axis=axis)) -
-                (self.mean_factor * np.ma.mean(data, axis=axis)))
+            data = self.sigma_clip(data, axis=axis, masked=masked)
+
+        if masked:
+            _median = _masked_median(data, axis=axis)
+            _mean = np.ma.mean(data, axis=axis)
+        else:
+            _median = _nanmedian(data, axis=axis)
+            _mean = np.nanmean(data, axis=axis)
+
+        return (self.median_factor * _median) - (self.mean_factor * _mean)
 
 
 class MMMBackground(ModeEstimatorBackground):
@@ -365,9 +455,12 @@ class SExtractorBackground(BackgroundBase):
     49.5
     """
 
-    def calc_background(self, data, axis=None):
+    def calc_background(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
+            data = self.sigma_clip(data, axis=axis, masked=masked)
+
+        if not masked:
+            return self._calc_background_nan(data, axis=axis)
 
         _median = np.atleast_1d(_masked_median(data, axis=axis))
         _mean = np.atleast_1d(np.ma.mean(data, axis=axis))
@@ -386,6 +479,27 @@ class SExtractorBackground(BackgroundBase):
 
         return bkg
 
+    @staticmethod
+    def _calc_background_nan(data, axis=None):
+        """
+        Calculate the background value for a `~numpy.ndarray` where
+        masked values are represented by ``np.nan``.
+        """
+
+        _median = _nanmedian(data, axis=axis)
+        _mean = np.nanmean(data, axis=axis)
+        _std = np.nanstd(data, axis=axis)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            condition = (np.abs(_mean - _median) / _std) < 0.3
+        bkg = np.where(condition, (2.5 * _median) - (1.5 * _mean), _median)
+        bkg = np.where(_std == 0, _mean, bkg)
+
+        if axis is None:
+            bkg = bkg.item()
+
+        return bkg
+
 
 class BiweightLocationBackground(BackgroundBase):
     """
@@ -434,11 +548,16 @@ class BiweightLocationBackground(BackgroundBase):
         self.c = c
         self.M = M
 
-    def calc_background(self, data, axis=None):
+    def calc_background(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
+            data = self.sigma_clip(data, axis=axis, masked=masked)
 
-        return biweight_location(data, c=self.c, M=self.M, axis=axis)
+        if masked:
+            return biweight_location(data, c=self.c, M=self.M, axis=axis)
+        else:
+            bkg = biweight_location(np.ma.masked_invalid(data), c=self.c,
+                                    M=self.M, axis=axis)
+            return np.ma.filled(bkg, np.nan)[()]
 
 
 class StdBackgroundRMS(BackgroundRMSBase):
@@ -477,11 +596,14 @@ class StdBackgroundRMS(BackgroundRMSBase):
     28.86607004772212
     """
 
-    def calc_background_rms(self, data, axis=None):
+    def calc_background_rms(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
+            data = self.sigma_clip(data, axis=axis, masked=masked)
 
-        return np.ma.std(data, axis=axis)
+        if masked:
+            return np.ma.std(data, axis=axis)
+        else:
+            return np.nanstd(data, axis=axis)
 
 
 class MADStdBackgroundRMS(BackgroundRMSBase):
@@ -531,11 +653,14 @@ class MADStdBackgroundRMS(BackgroundRMSBase):
     37.06505546264005
     """
 
-    def calc_background_rms(self, data, axis=None):
+    def calc_background_rms(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
+            data = self.sigma_clip(data, axis=axis, masked=masked)
 
-        return mad_std(data, axis=axis)
+        if masked:
+            return mad_std(data, axis=axis)
+        else:
+            return mad_std(data, axis=axis, ignore_nan=True)
 
 
 class BiweightScaleBackgroundRMS(BackgroundRMSBase):
@@ -585,8 +710,13 @@ class BiweightScaleBackgroundRMS(BackgroundRMSBase):
         self.c = c
         self.M = M
 
-    def calc_background_rms(self, data, axis=None):
+    def calc_background_rms(self, data, axis=None, masked=True):
         if self.sigma_clip is not None:
-            data = self.sigma_clip(data, axis=axis)
-
-        return biweight_scale(data, c=self.c, M=self.M, axis=axis)
+            data = self.sigma_clip(data, axis=axis, masked=masked)
+
+        if masked:
+            return biweight_scale(data, c=self.c, M=self.M, axis=axis)
+        else:
+            bkgrms = biweight_scale(np.ma.masked_invalid(data), c=self.c,
+                                    M=self.M, axis=axis)
+            return np.ma.filled(bkgrms, np.nan)[()]
@@ -9,9 +9,11 @@ import numpy as np
 from numpy.testing import assert_allclose, assert_equal
 import pytest
 
-from ..core import MeanBackground
+from ..core import (BackgroundBase, BackgroundRMSBase, MeanBackground,
+                    StdBackgroundRMS)
 from ..background_2d import (BkgZoomInterpolator, BkgIDWInterpolator,
-                             Background2D)
+                             Background2D, _calc_idw_weights)
+from ...utils import ShepardIDWInterpolator
 
 try:
     import scipy  # noqa
@@ -27,13 +29,15 @@ except ImportError:
 
 
 DATA = np.ones((100, 100))
+NOISE_DATA = np.random.default_rng(0).normal(1.0, 0.1, DATA.shape)
 BKG_RMS = np.zeros((100, 100))
 BKG_MESH = np.ones((4, 4))
 BKG_RMS_MESH = np.zeros((4, 4))
 PADBKG_MESH = np.ones((5, 5))
 PADBKG_RMS_MESH = np.zeros((5, 5))
 FILTER_SIZES = [(1, 1), (3, 3)]
-INTERPOLATORS = [BkgZoomInterpolator(), BkgIDWInterpolator()]
+INTERPOLATORS = [BkgZoomInterpolator(), BkgZoomInterpolator(method='fft'),
+                 BkgIDWInterpolator()]
 
 
 @pytest.mark.skipif('not HAS_SCIPY')
@@ -51,6 +55,18 @@ class TestBackground2D:
         assert b.background_median == 1.0
         assert b.background_rms_median == 0.0
 
+    @pytest.mark.parametrize('interpolator', INTERPOLATORS)
+    def test_background_constant_dtype(self, interpolator):
+        data = DATA.astype(np.float32)
+        b = Background2D(data, (25, 25), interpolator=interpolator)
+        assert b.background.dtype == np.float32
+        assert b.background_rms.dtype == np.float32
+
+        b = Background2D(DATA.astype(int), (25, 25),
+                         interpolator=interpolator)
+        assert b.background.dtype == np.float64
+        assert b.background_rms.dtype == np.float64
+
     @pytest.mark.parametrize('interpolator', INTERPOLATORS)
     def test_background_nonconstant(self, interpolator):
         data = np.copy(DATA)
@@ -66,6 +82,49 @@ class TestBackground2D:
         assert_allclose(b2.background_mesh, bkg_low_res)
         assert b2.background.shape == data.shape
 
+    def test_idw_nonsquare(self):
+        """Test the IDW interpolator with a non-square image."""
+
+        data = np.ones((50, 100))
+        data[:, 50:] = 2.
+        b = Background2D(data, (25, 25), filter_size=(1, 1),
+                         interpolator=BkgIDWInterpolator(n_neighbors=1))
+        assert b.data_coords.shape == (data.size, 2)
+        assert_allclose(b.background, data)
+
+    def test_idw_cache(self):
+        data = NOISE_DATA
+        mask = np.zeros(data.shape, dtype=bool)
+        mask[:10, :10] = True
+        b = Background2D(data, (10, 10), mask=mask, filter_size=(1, 1),
+                         interpolator=BkgIDWInterpolator())
+
+        # only the weights of the excluded meshes are cached (and
+        # shared by the background and background RMS meshes); the
+        # full-sized weights are never cached
+        b.background
+        b.background_rms
+        assert len(b._idw_cache) == 1
+        idx, _ = list(b._idw_cache.values())[0]
+        assert idx.shape[0] == np.count_nonzero(b._mesh_mask)
+
+    @pytest.mark.parametrize('n_neighbors', [1, 5, 30])
+    def test_idw_weights(self, n_neighbors):
+        """Test the IDW weights against ShepardIDWInterpolator."""
+
+        rng = np.random.default_rng(0)
+        coords = rng.uniform(0, 10, (20, 2))
+        coords[0] = (5, 5)
+        values = rng.normal(size=20)
+        positions = np.vstack([rng.uniform(0, 10, (50, 2)), [(5, 5)]])
+
+        idx, weights = _calc_idw_weights(coords, positions,
+                                         n_neighbors=n_neighbors, power=2.)
+        result = np.sum(weights * values[idx], axis=1)
+        ref = ShepardIDWInterpolator(coords, values)(
+            positions, n_neighbors=n_neighbors, power=2.)
+        assert_allclose(result, ref)
+
     def test_no_sigma_clipping(self):
         data = np.copy(DATA)
         data[10, 10] = 100.
@@ -85,6 +144,22 @@ class TestBackground2D:
         assert_allclose(b1.background, b2.background)
         assert_allclose(b1.background_rms, b2.background_rms)
 
+    def test_crop_nonsquare(self):
+        data = np.ones((100, 90))
+        b = Background2D(data, (23, 22), filter_size=(1, 1),
+                         edge_method='crop')
+        assert b.background_mesh.shape == (4, 4)
+        assert_allclose(b.background, data)
+
+    def test_data_unchanged(self):
+        """The in-place sigma clipping must not modify the input data."""
+
+        data = NOISE_DATA[:, :25].copy()
+        data[10, 10] = 100.
+        data_orig = data.copy()
+        Background2D(data, (25, 25))
+        assert_equal(data, data_orig)
+
     @pytest.mark.parametrize('box_size', ([(25, 25), (23, 22)]))
     def test_background_mask(self, box_size):
         """
@@ -106,6 +181,16 @@ class TestBackground2D:
                           bkg_estimator=MeanBackground(), edge_method='crop')
         assert_allclose(b2.background, DATA)
 
+    def test_mask_nonbool(self):
+        data = np.copy(DATA)
+        data[25:50, 25:50] = 100.
+        mask = np.zeros(DATA.shape, dtype=int)
+        mask[25:50, 25:50] = 1
+        b1 = Background2D(data, (23, 22), filter_size=(1, 1), mask=mask)
+        b2 = Background2D(data, (23, 22), filter_size=(1, 1),
+                          mask=mask.astype(bool))
+        assert_equal(b1.background_mesh, b2.background_mesh)
+
     def test_mask(self):
         data = np.copy(DATA)
         data[25:50, 25:50] = 100.
@@ -174,6 +259,17 @@ class TestBackground2D:
                           filter_threshold=11.)  # no filtering
         assert b2.background_mesh[1, 2] == 10
 
+    @pytest.mark.parametrize('filter_size', [(3, 3), (4, 5)])
+    def test_filter_threshold_all(self, filter_size):
+        """Selectively filtering all meshes is the same as no threshold."""
+
+        data = NOISE_DATA
+        b1 = Background2D(data, (10, 10), filter_size=filter_size)
+        b2 = Background2D(data, (10, 10), filter_size=filter_size,
+                          filter_threshold=-np.inf)
+        assert_allclose(b1.background_mesh, b2.background_mesh)
+        assert_allclose(b1.background_rms_mesh, b2.background_rms_mesh)
+
     def test_filter_threshold_high(self):
         """No filtering because filter_threshold is too large."""
 
@@ -196,6 +292,44 @@ class TestBackground2D:
                          filter_threshold=1.)
         assert_allclose(b.background_mesh, ref_data)
 
+    @pytest.mark.parametrize('filter_size', [(3, 3), (4, 5), (1, 3)])
+    def test_filter_meshes(self, filter_size):
+        """Test the mesh median filter against scipy.ndimage."""
+
+        from scipy.ndimage import generic_filter
+
+        data = NOISE_DATA
+        b = Background2D(data, (10, 10), filter_size=filter_size)
+        ref = generic_filter(b._background_mesh_unfiltered, np.nanmedian,
+                             size=filter_size, mode='constant', cval=np.nan)
+        assert_allclose(b.background_mesh, ref)
+
+    @pytest.mark.parametrize('filter_threshold', [None, 1.0])
+    def test_filter_nanmedian(self, monkeypatch, filter_threshold):
+        """Test that the filtering does not depend on the median
+        function (e.g., bottleneck or numpy)."""
+
+        data = NOISE_DATA
+        b1 = Background2D(data, (10, 10), filter_size=(3, 3),
+                          filter_threshold=filter_threshold)
+        monkeypatch.setattr(Background2D, '_nanmedian',
+                            staticmethod(np.nanmedian))
+        b2 = Background2D(data, (10, 10), filter_size=(3, 3),
+                          filter_threshold=filter_threshold)
+        assert_allclose(b1.background_mesh, b2.background_mesh)
+        assert_allclose(b1.background_rms_mesh, b2.background_rms_mesh)
+
+    def test_lazy_coordinates(self):
+        b = Background2D(DATA, (25, 25), filter_size=(1, 1),
+                         interpolator=BkgZoomInterpolator())
+        assert b.background.shape == DATA.shape
+        assert 'yx' not in b.__dict__
+        assert 'data_coords' not in b.__dict__
+
+        assert_equal(b.yx, np.column_stack([b.y, b.x]))
+        assert_equal(b.y, np.repeat([12., 37., 62., 87.], 4))
+        assert_equal(b.x, np.tile([12., 37., 62., 87.], 4))
+
     def test_scalar_sizes(self):
         b1 = Background2D(DATA, (25, 25), filter_size=(3, 3))
         b2 = Background2D(DATA, 25, filter_size=3)
@@ -209,6 +343,89 @@ class TestBackground2D:
         with pytest.raises(ValueError):
             Background2D(DATA, (5, 5), exclude_percentile=101)
 
+    def test_nthreads(self):
+        data = NOISE_DATA
+        mask = np.zeros(DATA.shape, dtype=bool)
+        mask[25:50, 25:50] = True
+        b1 = Background2D(data, (10, 10), mask=mask, exclude_percentile=50)
+        b2 = Background2D(data, (10, 10), mask=mask, exclude_percentile=50,
+                          nthreads=3)
+        assert_equal(b1.background_mesh, b2.background_mesh)
+        assert_equal(b1.background_rms_mesh, b2.background_rms_mesh)
+
+        with pytest.raises(ValueError):
+            Background2D(DATA, (25, 25), nthreads=0)
+
+    def test_old_signature_estimators(self):
+        """
+        Test estimators whose calc_background(_rms) methods do not
+        accept the masked keyword.
+        """
+
+        class OldMeanBackground(BackgroundBase):
+            def calc_background(self, data, axis=None):
+                return np.ma.mean(data, axis=axis)
+
+        class OldStdBackgroundRMS(BackgroundRMSBase):
+            def calc_background_rms(self, data, axis=None):
+                return np.ma.std(data, axis=axis)
+
+        data = NOISE_DATA
+        mask = np.zeros(DATA.shape, dtype=bool)
+        mask[25:30, 25:50] = True
+        b1 = Background2D(data, (10, 10), mask=mask,
+                          bkg_estimator=OldMeanBackground(),
+                          bkgrms_estimator=OldStdBackgroundRMS())
+        b2 = Background2D(data, (10, 10), mask=mask,
+                          bkg_estimator=MeanBackground(),
+                          bkgrms_estimator=StdBackgroundRMS())
+        assert_allclose(b1.background_mesh, b2.background_mesh)
+        assert_allclose(b1.background_rms_mesh, b2.background_rms_mesh)
+
+    def test_no_sigma_clip(self):
+        """
+        Test that without sigma clipping the estimators are applied
+        directly to the NaN-masked mesh data.
+        """
+
+        class NaNMeanBackground(MeanBackground):
+            def calc_background(self, data, axis=None, masked=True):
+                assert not np.ma.isMaskedArray(data)
+                assert not masked
+                return super().calc_background(data, axis=axis,
+                                               masked=masked)
+
+        data = np.copy(NOISE_DATA)
+        mask = np.zeros(DATA.shape, dtype=bool)
+        mask[25:30, 25:50] = True
+        b = Background2D(data, (10, 10), mask=mask, sigma_clip=None,
+                         bkg_estimator=NaNMeanBackground(), filter_size=1,
+                         exclude_percentile=50)
+
+        data[mask] = np.nan
+        mesh = np.nanmean(data.reshape(10, 10, 10, 10), axis=(1, 3))
+        assert_allclose(b.background_mesh, mesh)
+
+    def test_nan_data(self):
+        data = np.copy(DATA)
+        data[25:50, 25:50] = np.nan
+        data[60, 70] = np.nan
+        b = Background2D(data, (25, 25))
+        assert_allclose(b.background, DATA)
+        assert_allclose(b.background_rms, BKG_RMS)
+
+    def test_masked_array_data(self):
+        data = np.copy(NOISE_DATA)
+        mask = np.zeros(DATA.shape, dtype=bool)
+        mask[25:50, 25:50] = True
+        data[mask] = 1000.
+        data_ma = np.ma.masked_array(data, mask=mask)
+        b1 = Background2D(data_ma, (25, 25))
+        b2 = Background2D(data, (25, 25), mask=mask)
+        assert np.max(b1.background) < 1.5
+        assert_equal(b1.background, b2.background)
+        assert_equal(b1.background_rms, b2.background_rms)
+
     def test_mask_badshape(self):
         with pytest.raises(ValueError):
             Background2D(DATA, (25, 25), filter_size=(1, 1),
@@ -224,6 +441,39 @@ class TestBackground2D:
             Background2D(DATA, (23, 22), filter_size=(1, 1),
                          edge_method='not_valid')
 
+    def test_invalid_zoom_method(self):
+        with pytest.raises(ValueError):
+            BkgZoomInterpolator(method='not_valid')
+
+    @pytest.mark.parametrize('edge_method', ['pad', 'crop'])
+    def test_zoom_fft(self, edge_method):
+        yy, xx = np.mgrid[0:100, 0:100]
+        data = 1. + 0.1 * np.sin(yy / 30.) + 0.1 * np.cos(xx / 20.)
+        b = Background2D(data, (10, 10), filter_size=(1, 1),
+                         edge_method=edge_method, sigma_clip=None,
+                         interpolator=BkgZoomInterpolator(method='fft'))
+        assert b.background.shape == data.shape
+        assert_allclose(b.background, data, atol=0.02)
+
+    @pytest.mark.parametrize('edge_method', ['pad', 'crop'])
+    def test_zoom_linear(self, edge_method):
+        """Test the order=1 fast path against scipy.ndimage.zoom."""
+
+        from scipy.ndimage import zoom
+
+        data = NOISE_DATA[:, :90]
+        b = Background2D(data, (23, 23), filter_size=(1, 1),
+                         edge_method=edge_method,
+                         interpolator=BkgZoomInterpolator(order=1))
+        mesh = b.background_mesh
+        if edge_method == 'pad':
+            shape = (b.nyboxes * b.box_size[0], b.nxboxes * b.box_size[1])
+        else:
+            shape = data.shape
+        zoom_factor = (shape[0] / mesh.shape[0], shape[1] / mesh.shape[1])
+        ref = zoom(mesh, zoom_factor, order=1)[0:100, 0:90]
+        assert_allclose(b.background, ref)
+
     def test_invalid_mesh_idx_len(self):
         with pytest.raises(ValueError):
             bkg = Background2D(DATA, (25, 25), filter_size=(1, 1))
@@ -238,3 +488,67 @@ class TestBackground2D:
 
         b = Background2D(DATA, (25, 25))
         b.plot_meshes(outlines=True)
+
+    @pytest.mark.skipif('not HAS_MATPLOTLIB')
+    def test_plot_meshes_outlines(self):
+        import matplotlib.pyplot as plt
+
+        b = Background2D(DATA, (25, 20))
+        fig, axes = plt.subplots()
+        b.plot_meshes(axes=axes, outlines=True)
+        assert len(axes.lines) == 1  # centers
+        assert len(axes.collections) == 1  # outlines
+        paths = axes.collections[-1].get_paths()
+        assert len(paths) == b.nboxes
+        assert_allclose(paths[0].get_extents().bounds, (-0.5, -0.5, 20, 25))
+        plt.close(fig)
+
+    @pytest.mark.skipif('not HAS_MATPLOTLIB')
+    def test_plot_meshes_limits(self):
+        import matplotlib.pyplot as plt
+
+        b = Background2D(DATA, (25, 20))
+        fig, axes = plt.subplots()
+        axes.set_xlim(0, 30)
+        axes.set_ylim(60, 30)
+        b.plot_meshes(axes=axes, outlines=True)
+        assert len(axes.collections[-1].get_paths()) == 4
+        assert axes.get_xlim() == (0, 30)
+        plt.close(fig)
+
+    @pytest.mark.skipif('not HAS_MATPLOTLIB')
+    def test_plot_meshes_autoscale(self):
+        import matplotlib.pyplot as plt
+
+        b = Background2D(DATA, (25, 25))
+        fig, axes = plt.subplots()
+        b.plot_meshes(axes=axes, outlines=True)
+        xmin, xmax = axes.get_xlim()
+        ymin, ymax = axes.get_ylim()
+        assert xmin <= -0.5 and xmax >= 99.5
+        assert ymin <= -0.5 and ymax >= 99.5
+        plt.close(fig)
+
+    @pytest.mark.skipif('not HAS_MATPLOTLIB')
+    def test_plot_meshes_colors(self):
+        import matplotlib.pyplot as plt
+
+        b = Background2D(DATA, (25, 20))
+        colors = ['red', 'blue'] * (b.nboxes // 2)
+        fig, axes = plt.subplots()
+        axes.set_xlim(0, 30)
+        b.plot_meshes(axes=axes, color=colors, outlines=True)
+        assert len(axes.collections) == 2  # centers and outlines
+        assert len(axes.collections[0].get_offsets()) == 8
+        plt.close(fig)
+
+    @pytest.mark.skipif('not HAS_MATPLOTLIB')
+    def test_plot_meshes_rasterized(self):
+        import matplotlib.pyplot as plt
+
+        b = Background2D(DATA, (25, 25))
+        fig, axes = plt.subplots()
+        b.plot_meshes(axes=axes, outlines=True, rasterized=True)
+        assert axes.lines[0].get_rasterized()
+        assert axes.collections[0].get_rasterized()
+        plt.close(fig)
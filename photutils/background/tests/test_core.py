@@ -3,15 +3,19 @@
 Tests for the core module.
 """
 
+import warnings
+
 from astropy.stats import SigmaClip
 import numpy as np
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_equal
 import pytest
 
-from ..core import (BiweightLocationBackground, BiweightScaleBackgroundRMS,
+from .. import core
+from ..core import (BackgroundBase, BackgroundRMSBase,
+                    BiweightLocationBackground, BiweightScaleBackgroundRMS,
                     MADStdBackgroundRMS, MeanBackground, MedianBackground,
                     MMMBackground, ModeEstimatorBackground,
-                    SExtractorBackground, StdBackgroundRMS)
+                    SExtractorBackground, StdBackgroundRMS, _nanmedian)
 from ...datasets.make import make_noise_image
 
 BKG = 0.0
@@ -87,3 +91,83 @@ def test_background_rms(rms_class):
     bkgrms = rms_class(sigma_clip=SIGMA_CLIP)
     assert_allclose(bkgrms.calc_background_rms(DATA), STD, atol=1.e-2)
     assert_allclose(bkgrms(DATA), bkgrms.calc_background_rms(DATA))
+
+
+@pytest.mark.parametrize('bkg_class', BKG_CLASS)
+def test_background_nan_masked(bkg_class):
+    data = np.copy(DATA)
+    data[10:20, 30:40] = np.nan
+    data_ma = np.ma.masked_invalid(data)
+    bkg = bkg_class(sigma_clip=SIGMA_CLIP)
+
+    bkgval = bkg.calc_background(data, masked=False)
+    assert not np.ma.isMaskedArray(bkgval)
+    assert np.isscalar(bkgval)
+    assert_allclose(bkgval, bkg.calc_background(data_ma))
+
+    bkg_arr = bkg(data, axis=1, masked=False)
+    assert not np.ma.isMaskedArray(bkg_arr)
+    assert_allclose(bkg_arr, bkg(data_ma, axis=1))
+
+
+@pytest.mark.parametrize('rms_class', RMS_CLASS)
+def test_background_rms_nan_masked(rms_class):
+    data = np.copy(DATA)
+    data[10:20, 30:40] = np.nan
+    data_ma = np.ma.masked_invalid(data)
+    bkgrms = rms_class(sigma_clip=SIGMA_CLIP)
+
+    rmsval = bkgrms.calc_background_rms(data, masked=False)
+    assert not np.ma.isMaskedArray(rmsval)
+    assert np.isscalar(rmsval)
+    assert_allclose(rmsval, bkgrms.calc_background_rms(data_ma))
+
+    rms_arr = bkgrms(data, axis=1, masked=False)
+    assert not np.ma.isMaskedArray(rms_arr)
+    assert_allclose(rms_arr, bkgrms(data_ma, axis=1))
+
+
+@pytest.mark.parametrize('has_bottleneck', [False, core.HAS_BOTTLENECK])
+def test_nanmedian(monkeypatch, has_bottleneck):
+    monkeypatch.setattr(core, 'HAS_BOTTLENECK', has_bottleneck)
+
+    data = np.random.default_rng(0).normal(size=(7, 8, 700))
+    data[data > 1.5] = np.nan
+    data[2, 3] = np.nan
+    data[4, :, 1:] = np.nan
+    for axis in (None, 0, 1, 2, -1, (1, 2)):
+        with warnings.catch_warnings():
+            # all-NaN slices
+            warnings.simplefilter('ignore', RuntimeWarning)
+            result = _nanmedian(data, axis=axis)
+            expected = np.nanmedian(data, axis=axis)
+        assert_equal(result, expected)
+
+    assert _nanmedian(np.arange(5.), axis=0) == 2.
+    assert np.isscalar(_nanmedian(np.arange(5.), axis=0))
+
+    # all-NaN slices return NaN without a warning
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for axis in (None, 1, (1, 2)):
+            result = _nanmedian(np.full((3, 4, 5), np.nan), axis=axis)
+            assert np.all(np.isnan(result))
+
+
+def test_old_signature_subclass():
+    """
+    Test subclasses whose calc_background(_rms) methods do not accept
+    the masked keyword.
+    """
+
+    class OldMeanBackground(BackgroundBase):
+        def calc_background(self, data, axis=None):
+            return np.ma.mean(data, axis=axis)
+
+    class OldStdBackgroundRMS(BackgroundRMSBase):
+        def calc_background_rms(self, data, axis=None):
+            return np.ma.std(data, axis=axis)
+
+    assert_allclose(OldMeanBackground(sigma_clip=None)(DATA), np.mean(DATA))
+    assert_allclose(OldStdBackgroundRMS(sigma_clip=None)(DATA, axis=1),
+                    np.std(DATA, axis=1))